@@ -1,12 +1,19 @@
 #!/bin/sh
-echo "Container environment:"
-ls -la .
-echo ""
-echo "Environment variables:"
-env | grep -E "TOKEN|CREDENTIALS"
-echo ""
-echo "Content of .env file:"
-if [ -f .env ]; then cat .env; else echo ".env file not found"; fi
-echo ""
+# LOG_LEVEL may only be set in the mounted .env file, which python-dotenv reads later;
+# take the first match and strip the \r a Windows-edited .env leaves at line ends
+LOG_LEVEL="${LOG_LEVEL:-$(sed -n 's/^LOG_LEVEL=//p' .env 2>/dev/null | head -n 1 | tr -d '\r')}"
+
+# Only dump the container environment when debugging
+if [ "$(printf '%s' "$LOG_LEVEL" | tr '[:lower:]' '[:upper:]')" = "DEBUG" ]; then
+    echo "Container environment:"
+    ls -la .
+    echo ""
+    echo "Environment variables:"
+    env | grep -E "TOKEN|CREDENTIALS"
+    echo ""
+    echo "Content of .env file:"
+    if [ -f .env ]; then cat .env; else echo ".env file not found"; fi
+    echo ""
+fi
 echo "Starting bot..."
 exec "$@"
\ No newline at end of file
@@ -1,169 +1,359 @@
 #!/usr/bin/env python
 import os
 import logging
-import tempfile
-import sqlite3
 import asyncio
+import time
+import aiosqlite
+from aiosqlitepool import SQLiteConnectionPool
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
 from google.cloud import speech
-from pydub import AudioSegment
 
-# Load environment variables from .env file first
-load_dotenv()
-
-# Configure logging with more detailed format
-# Get log level from environment variable, default to DEBUG if not specified
-LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG')
-numeric_level = getattr(logging, LOG_LEVEL.upper(), logging.DEBUG)
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=numeric_level
-)
 logger = logging.getLogger(__name__)
 
-logger.info(f"Logging level set to: {LOG_LEVEL}")
-
-# Get environment variables
-TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-logger.info(f"Loaded TELEGRAM_TOKEN: {TELEGRAM_TOKEN[:4]}...{TELEGRAM_TOKEN[-4:] if TELEGRAM_TOKEN else 'None'}")
+# Settings read from the environment by init(), once .env has been loaded
+TELEGRAM_TOKEN = None
+DB_PATH = 'data/stats.db'  # Database file path, can be overridden by env var
 
 # Constants
 MAX_AUDIO_MINUTES = 50  # Maximum allowed audio processing time in minutes (global limit)
-DB_PATH = os.getenv('DB_PATH', 'data/stats.db')  # Database file path, can be overridden by env var
+GLOBAL_STATS_CACHE_TTL_SEC = 30.0  # How long cached global stats are reused when nothing new was written
+STREAM_CHUNK_BYTES = 16000  # PCM bytes per streaming request (0.5 s of 16kHz 16-bit mono audio)
+MAX_STREAM_AUDIO_SEC = 300  # Longest audio a single streaming recognition request accepts
+FFMPEG_POOL_SIZE = 2  # Idle ffmpeg processes kept ready for upcoming voice messages
+FLUSH_BATCH_SIZE = 50  # Maximum number of queued audio_stats rows written per flush
+FLUSH_INTERVAL_SEC = 1.0  # Maximum time a queued row waits before being flushed
+FLUSH_MAX_ATTEMPTS = 5  # Failed flushes of a batch before its rows are dropped
+FLUSH_RETRY_BASE_SEC = 1.0  # Backoff before the first retry, doubled on each further failure
+WAL_CHECKPOINT_INTERVAL_SEC = 300  # How often the WAL is checkpointed and truncated
+MAX_CONCURRENT_UPDATES = 16  # Updates handled at once, so a long transcription doesn't hold up /stats
+USER_STATS_CACHE_TTL_SEC = 60.0  # How long a user's cached stats are reused
 
-# Create data directory if it doesn't exist
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+# Running global total in seconds, loaded from the database at startup and kept current by record_and_check
+_total_audio_sec = 0.0
 
-# Initialize database connection
-def init_db():
-    """Initialize the SQLite database for tracking audio processing stats."""
-    logger.info(f"Initializing database at {DB_PATH}")
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Create tables if they don't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS audio_stats (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER NOT NULL,
-        username TEXT,
-        audio_length_sec REAL NOT NULL,
-        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Create global stats table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS global_stats (
-        id INTEGER PRIMARY KEY CHECK (id = 1),
-        total_audio_sec REAL DEFAULT 0,
-        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Insert initial global stats record if it doesn't exist
-    cursor.execute('''
-    INSERT OR IGNORE INTO global_stats (id, total_audio_sec, last_updated)
-    VALUES (1, 0, CURRENT_TIMESTAMP)
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("Database initialization completed")
+# In-process caches for frequently repeated stats reads
+_global_stats_cache = {'last_updated': None, 'top_users': [], 'expires_at': 0.0}
+_user_cache = {}  # user_id -> {'total_audio_sec', 'last_updated', 'expires_at'}
 
-# Track audio processing in the database
-def track_audio_processing(user_id, username, audio_length_sec):
-    """Record audio processing stats in the database and update global counter."""
-    logger.info(f"Tracking audio processing: {username} ({user_id}), {audio_length_sec:.2f} seconds")
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+# Audio stats rows waiting to be written by the flusher
+_pending = asyncio.Queue()
+_pending_users = {}  # user_id -> {'total_audio_sec', 'rows', 'last_updated'} for queued rows
+_flusher_task = None
+
+# Pre-spawned ffmpeg processes, each used for a single voice message
+_ffmpeg_pool = asyncio.Queue()
+_ffmpeg_refill_task = None
+_background_tasks = set()
+
+# Held while stats are read from the database or a batch is committed, so pending seconds are never double counted
+_total_lock = asyncio.Lock()
+
+# Queries run on every message or stats command, each defined once and shared by the helpers that run it
+SQL_INSERT_STATS = "INSERT INTO audio_stats (user_id, username, audio_length_sec) VALUES (?, ?, ?)"
+SQL_UPDATE_GLOBAL = '''
+UPDATE global_stats
+SET total_audio_sec = total_audio_sec + ?,
+    last_updated = CURRENT_TIMESTAMP
+WHERE id = 1
+'''
+SQL_SELECT_GLOBAL = "SELECT total_audio_sec FROM global_stats WHERE id = 1"
+SQL_SELECT_LAST_UPDATED = "SELECT last_updated FROM global_stats WHERE id = 1"
+SQL_SELECT_USER = '''
+SELECT SUM(audio_length_sec), MAX(processed_at)
+FROM audio_stats
+WHERE user_id = ?
+'''
+SQL_TOP_USERS = "SELECT username, total_sec FROM user_totals ORDER BY total_sec DESC LIMIT 5"
+
+# Per-connection SQLite tuning applied to every pooled connection
+CONNECTION_PRAGMAS = '''
+PRAGMA busy_timeout=5000;
+PRAGMA wal_autocheckpoint=0;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+PRAGMA mmap_size=268435456;
+'''
+
+# Open a new connection for the pool
+async def _connect():
+    """Create a tuned SQLite connection for the connection pool."""
+    conn = await aiosqlite.connect(DB_PATH)
+    await conn.executescript(CONNECTION_PRAGMAS)
+    return conn
+
+# Pool of long-lived connections shared by all DB helpers
+pool = SQLiteConnectionPool(_connect, pool_size=5)
+
+# Initialize database schema
+async def init_db():
+    """Initialize the SQLite database for tracking audio processing stats."""
+    logger.info("Initializing database at %s", DB_PATH)
+    async with pool.connection() as conn:
+        # WAL is persistent per database file, so switching once is enough
+        await conn.execute("PRAGMA journal_mode=WAL")
         
-        # Insert record into audio_stats
-        cursor.execute(
-            "INSERT INTO audio_stats (user_id, username, audio_length_sec) VALUES (?, ?, ?)",
-            (user_id, username, audio_length_sec)
+        # Create tables if they don't exist
+        await conn.execute('''
+        CREATE TABLE IF NOT EXISTS audio_stats (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            audio_length_sec REAL NOT NULL,
+            processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
+        ''')
         
-        # Update global stats
-        cursor.execute('''
-        UPDATE global_stats 
-        SET total_audio_sec = total_audio_sec + ?, 
-            last_updated = CURRENT_TIMESTAMP
-        WHERE id = 1
-        ''', (audio_length_sec,))
+        # Create global stats table
+        await conn.execute('''
+        CREATE TABLE IF NOT EXISTS global_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_audio_sec REAL DEFAULT 0,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # Covering index for the per-user aggregation
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_audio_user_totals ON audio_stats(user_id, audio_length_sec, processed_at)"
+        )
+        
+        # Per-username totals for the top users list, so it doesn't aggregate the whole history
+        await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_totals (
+            username TEXT PRIMARY KEY,
+            total_sec REAL NOT NULL DEFAULT 0
+        )
+        ''')
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_totals_sec ON user_totals(total_sec DESC)")
+        
+        # Backfill from existing history the first time the table is created
+        await conn.execute('''
+        INSERT INTO user_totals (username, total_sec)
+        SELECT COALESCE(username, ''), SUM(audio_length_sec)
+        FROM audio_stats
+        WHERE NOT EXISTS (SELECT 1 FROM user_totals)
+        GROUP BY COALESCE(username, '')
+        ''')
+        
+        # Insert initial global stats record if it doesn't exist
+        await conn.execute('''
+        INSERT OR IGNORE INTO global_stats (id, total_audio_sec, last_updated)
+        VALUES (1, 0, CURRENT_TIMESTAMP)
+        ''')
+        
+        # Keep user_totals in step with audio_stats inserts
+        await conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS add_to_user_totals AFTER INSERT ON audio_stats
+        BEGIN
+            INSERT INTO user_totals (username, total_sec)
+            VALUES (COALESCE(NEW.username, ''), NEW.audio_length_sec)
+            ON CONFLICT(username) DO UPDATE SET total_sec = total_sec + excluded.total_sec;
+        END
+        ''')
         
-        conn.commit()
-        conn.close()
-        logger.info(f"Successfully tracked audio processing for user {user_id}")
+        await conn.commit()
+    logger.info("Database initialization completed")
+
+# Load the global total once at startup
+async def load_total_audio_sec():
+    """Read the global audio total from the database into memory."""
+    global _total_audio_sec
+    async with pool.connection() as conn:
+        cursor = await conn.execute(SQL_SELECT_GLOBAL)
+        result = await cursor.fetchone()
+    _total_audio_sec = result[0] if result else 0.0
+    logger.info("Loaded global audio usage: %.2f minutes", _total_audio_sec / 60)
+
+# Forget rows that have left the pending queue
+def _unpend(rows):
+    """Subtract flushed or dropped rows from the pending per-user totals."""
+    for user_id, _, audio_length_sec in rows:
+        pending_user = _pending_users[user_id]
+        pending_user['rows'] -= 1
+        pending_user['total_audio_sec'] -= audio_length_sec
+        if pending_user['rows'] == 0:
+            del _pending_users[user_id]
+
+# Write a batch of queued audio stats rows
+async def _flush(rows) -> bool:
+    """Insert queued audio_stats rows and add their total to the global counter in one transaction.
+    
+    Returns False if the write failed, leaving the rows pending for a retry.
+    """
+    batch_sec = sum(row[2] for row in rows)
+    try:
+        async with _total_lock:
+            async with pool.connection() as conn:
+                await conn.execute("BEGIN IMMEDIATE")
+                try:
+                    await conn.executemany(SQL_INSERT_STATS, rows)
+                    
+                    # Update global stats once with the pre-summed batch total
+                    await conn.execute(SQL_UPDATE_GLOBAL, (batch_sec,))
+                    
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+            _unpend(rows)
+            _global_stats_cache['expires_at'] = 0.0
+        logger.debug("Flushed %d audio stats rows (%.2f seconds)", len(rows), batch_sec)
+        return True
     except Exception as e:
-        logger.error(f"Error tracking audio processing: {e}")
+        logger.error("Error flushing audio stats: %s", e)
+        return False
 
-# Check if global audio limit has been exceeded
-def check_global_audio_limit():
-    """Check if the total audio processing time has exceeded the global limit."""
+# Give up on a batch of queued audio stats rows
+async def _drop(rows):
+    """Discard rows that could not be written so the in-memory total keeps matching the database."""
+    global _total_audio_sec
+    batch_sec = sum(row[2] for row in rows)
+    async with _total_lock:
+        _unpend(rows)
+        _total_audio_sec -= batch_sec
+        for user_id, _, _ in rows:
+            _user_cache.pop(user_id, None)
+    logger.error("Dropped %d audio stats rows (%.2f seconds) after failed flushes", len(rows), batch_sec)
+
+# Background task draining the pending queue
+async def flusher():
+    """Flush queued audio stats every FLUSH_INTERVAL_SEC or FLUSH_BATCH_SIZE rows, whichever comes first.
+    
+    A failed batch is retried with exponential backoff, together with rows queued meanwhile,
+    and dropped after FLUSH_MAX_ATTEMPTS failures or when it fails during shutdown.
+    A None entry in the queue stops the flusher once the rows queued before it are written.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
+    rows = []
+    attempts = 0
+    while not stopping:
+        if not rows:
+            row = await _pending.get()
+            if row is None:
+                break
+            rows = [row]
+        deadline = loop.time() + FLUSH_INTERVAL_SEC
+        while len(rows) < FLUSH_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(_pending.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if row is None:
+                stopping = True
+                break
+            rows.append(row)
+        if await _flush(rows):
+            rows, attempts = [], 0
+            continue
+        attempts += 1
+        if stopping or attempts >= FLUSH_MAX_ATTEMPTS:
+            await _drop(rows)
+            rows, attempts = [], 0
+        else:
+            await asyncio.sleep(FLUSH_RETRY_BASE_SEC * 2 ** (attempts - 1))
+
+# Write out everything still queued before shutting down
+async def flusher_drain():
+    """Stop the flusher after it has written every queued audio stats row."""
+    if _flusher_task and not _flusher_task.done():
+        _pending.put_nowait(None)
+        await _flusher_task
+    
+    # Flush whatever is left if the flusher was not running
+    rows = []
+    while not _pending.empty():
+        row = _pending.get_nowait()
+        if row is not None:
+            rows.append(row)
+    for i in range(0, len(rows), FLUSH_BATCH_SIZE):
+        batch = rows[i:i + FLUSH_BATCH_SIZE]
+        if not await _flush(batch):
+            await _drop(batch)
+
+# Background task keeping the WAL small
+async def checkpointer():
+    """Checkpoint and truncate the WAL every WAL_CHECKPOINT_INTERVAL_SEC.
+    
+    Automatic checkpoints are disabled on pooled connections, so writers never stall on one.
+    """
+    while True:
+        await asyncio.sleep(WAL_CHECKPOINT_INTERVAL_SEC)
+        try:
+            async with pool.connection() as conn:
+                cursor = await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                busy, wal_pages, checkpointed_pages = await cursor.fetchone()
+            logger.debug("WAL checkpoint: busy=%s, %s/%s pages", busy, checkpointed_pages, wal_pages)
+        except Exception as e:
+            logger.error("Error checkpointing WAL: %s", e)
+
+# Track audio processing and check the global limit
+def record_and_check(user_id, username, audio_length_sec) -> tuple[bool, float]:
+    """Queue audio processing stats for the flusher and return (limit_reached, total_audio_min)."""
+    global _total_audio_sec
+    logger.debug("Tracking audio processing: %s (%s), %.2f seconds", username, user_id, audio_length_sec)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get total audio time
-        cursor.execute("SELECT total_audio_sec FROM global_stats WHERE id = 1")
-        result = cursor.fetchone()
-        conn.close()
+        # Nothing here awaits, so concurrent handlers can't interleave their updates
+        _pending.put_nowait((user_id, username, audio_length_sec))
+        _total_audio_sec += audio_length_sec
+        total_audio_sec = _total_audio_sec
         
-        if result:
-            total_audio_sec = result[0]
-            total_audio_min = total_audio_sec / 60
-            logger.info(f"Global audio usage: {total_audio_min:.2f} minutes")
-            return total_audio_min >= MAX_AUDIO_MINUTES, total_audio_min
+        # Track the user's queued seconds and bump their cached stats, if any
+        now_utc = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        pending_user = _pending_users.setdefault(user_id, {'total_audio_sec': 0.0, 'rows': 0, 'last_updated': None})
+        pending_user['total_audio_sec'] += audio_length_sec
+        pending_user['rows'] += 1
+        pending_user['last_updated'] = now_utc
+        if user_id in _user_cache:
+            _user_cache[user_id]['total_audio_sec'] += audio_length_sec
+            _user_cache[user_id]['last_updated'] = now_utc
+        logger.debug("Successfully queued audio processing for user %s", user_id)
         
-        return False, 0
+        total_audio_min = total_audio_sec / 60
+        return total_audio_min >= MAX_AUDIO_MINUTES, total_audio_min
     except Exception as e:
-        logger.error(f"Error checking global audio limit: {e}")
-        # In case of error, allow processing to proceed
+        logger.error("Error tracking audio processing: %s", e)
         return False, 0
 
+# Check if global audio limit has been exceeded
+def check_global_audio_limit():
+    """Check if the total audio processing time has exceeded the global limit."""
+    total_audio_min = _total_audio_sec / 60
+    logger.debug("Global audio usage: %.2f minutes", total_audio_min)
+    return total_audio_min >= MAX_AUDIO_MINUTES, total_audio_min
+
 # Get global usage stats
-def get_global_stats():
+async def get_global_stats():
     """Get total audio processing stats."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT total_audio_sec, last_updated FROM global_stats WHERE id = 1")
-        result = cursor.fetchone()
-        
-        # Get top 5 users
-        cursor.execute('''
-        SELECT username, SUM(audio_length_sec) as total_sec
-        FROM audio_stats
-        GROUP BY username
-        ORDER BY total_sec DESC
-        LIMIT 5
-        ''')
-        top_users = cursor.fetchall()
-        
-        conn.close()
-        
-        if result:
-            total_audio_sec = result[0]
-            last_updated = result[1]
-            return {
-                'total_audio_min': total_audio_sec / 60,
-                'last_updated': last_updated,
-                'top_users': [(username, sec/60) for username, sec in top_users]
-            }
+        now = time.monotonic()
+        if now >= _global_stats_cache['expires_at']:
+            async with _total_lock:
+                async with pool.connection() as conn:
+                    cursor = await conn.execute(SQL_SELECT_LAST_UPDATED)
+                    result = await cursor.fetchone()
+                    
+                    # Get top 5 users
+                    cursor = await conn.execute(SQL_TOP_USERS)
+                    top_users = [(username, sec/60) for username, sec in await cursor.fetchall()]
+            
+            _global_stats_cache['last_updated'] = result[0] if result else None
+            _global_stats_cache['top_users'] = top_users
+            _global_stats_cache['expires_at'] = now + GLOBAL_STATS_CACHE_TTL_SEC
         
         return {
-            'total_audio_min': 0, 
-            'last_updated': None,
-            'top_users': []
+            'total_audio_min': _total_audio_sec / 60,
+            'last_updated': _global_stats_cache['last_updated'],
+            'top_users': _global_stats_cache['top_users']
         }
     except Exception as e:
-        logger.error(f"Error getting global stats: {e}")
+        logger.error("Error getting global stats: %s", e)
         return {
             'total_audio_min': 0, 
             'last_updated': None,
@@ -171,25 +361,36 @@ def get_global_stats():
         }
 
 # Get user-specific stats
-def get_user_stats(user_id):
+async def get_user_stats(user_id):
     """Get audio processing stats for a specific user."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get user's total audio time
-        cursor.execute('''
-        SELECT SUM(audio_length_sec), MAX(processed_at)
-        FROM audio_stats
-        WHERE user_id = ?
-        ''', (user_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
+        now = time.monotonic()
+        cached = _user_cache.get(user_id)
+        if cached is None or now >= cached['expires_at']:
+            async with _total_lock:
+                async with pool.connection() as conn:
+                    # Get user's total audio time
+                    cursor = await conn.execute(SQL_SELECT_USER, (user_id,))
+                    
+                    result = await cursor.fetchone()
+                
+                # Include rows that are still waiting to be flushed
+                total_audio_sec, last_updated = result if result else (None, None)
+                pending_user = _pending_users.get(user_id)
+                if pending_user:
+                    total_audio_sec = (total_audio_sec or 0) + pending_user['total_audio_sec']
+                    last_updated = pending_user['last_updated']
+            
+            cached = {
+                'total_audio_sec': total_audio_sec or 0,
+                'last_updated': last_updated,
+                'expires_at': now + USER_STATS_CACHE_TTL_SEC
+            }
+            _user_cache[user_id] = cached
         
-        if result and result[0]:
-            total_audio_sec = result[0]
-            last_updated = result[1]
+        if cached['total_audio_sec']:
+            total_audio_sec = cached['total_audio_sec']
+            last_updated = cached['last_updated']
             return {
                 'total_audio_min': total_audio_sec / 60,
                 'last_updated': last_updated
@@ -197,7 +398,7 @@ def get_user_stats(user_id):
         
         return {'total_audio_min': 0, 'last_updated': None}
     except Exception as e:
-        logger.error(f"Error getting user stats: {e}")
+        logger.error("Error getting user stats: %s", e)
         return {'total_audio_min': 0, 'last_updated': None}
 
 # Debug environment
@@ -207,40 +408,50 @@ def log_sensitive_info(value):
         return "****"
     return f"{value[:4]}...{value[-4:]}"
 
-# Log key environment variables and config
-logger.info("Configuration summary:")
-# Log the existence of .env file
-env_path = os.path.join(os.getcwd(), '.env')
-env_exists = os.path.exists(env_path)
-logger.info(f".env file: {'Present' if env_exists else 'Not found'} at {env_path}")
-
-# Log critical environment variables with masking
-critical_vars = {
-    "TELEGRAM_TOKEN": TELEGRAM_TOKEN,
-    "GOOGLE_APPLICATION_CREDENTIALS": os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-}
+# Recognition settings shared by every config
+_STT_COMMON = dict(
+    language_code="sr-RS",  # Serbian language code
+    model="default",
+    enable_automatic_punctuation=True,
+)
 
-for key, value in critical_vars.items():
-    if value:
-        logger.info(f"  {key}: {log_sensitive_info(value) if 'TOKEN' in key or 'KEY' in key or 'SECRET' in key else value}")
-    else:
-        logger.error(f"  {key}: Missing")
+# Recognition settings are identical for every message, so build them once
+_STT_CONFIG = speech.RecognitionConfig(
+    encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+    sample_rate_hertz=16000,
+    **_STT_COMMON,
+)
+_STT_CONFIG_REQUEST = speech.StreamingRecognizeRequest(
+    streaming_config=speech.StreamingRecognitionConfig(config=_STT_CONFIG)
+)
 
-if not TELEGRAM_TOKEN:
-    logger.error("TELEGRAM_TOKEN not found in environment variables.")
-    raise ValueError("TELEGRAM_TOKEN not found in environment variables.")
+# Configs for sending Ogg Opus without conversion, keyed by the sample rates the API accepts for it
+_OGG_OPUS_CONFIG_REQUESTS = {
+    rate: speech.StreamingRecognizeRequest(
+        streaming_config=speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.OGG_OPUS,
+                sample_rate_hertz=rate,
+                **_STT_COMMON,
+            )
+        )
+    )
+    for rate in (8000, 12000, 16000, 24000, 48000)
+}
 
-# Initialize the database
-init_db()
+# Google Cloud Speech client, created in post_init so it binds to the bot's event loop
+speech_client = None
 
-# Initialize Google Cloud Speech client
-try:
-    logger.info("Initializing Google Cloud Speech client")
-    speech_client = speech.SpeechClient()
-    logger.info("Google Cloud Speech client initialized successfully")
-except Exception as e:
-    logger.error(f"Error initializing Google Cloud Speech client: {e}")
-    raise
+def init_speech_client():
+    """Initialize the asynchronous Google Cloud Speech client."""
+    global speech_client
+    try:
+        logger.info("Initializing Google Cloud Speech client")
+        speech_client = speech.SpeechAsyncClient()
+        logger.info("Google Cloud Speech client initialized successfully")
+    except Exception as e:
+        logger.error("Error initializing Google Cloud Speech client: %s", e)
+        raise
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
@@ -264,90 +475,222 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user_id = update.effective_user.id
     username = update.effective_user.username or update.effective_user.first_name
     
-    user_stats = get_user_stats(user_id)
+    user_stats = await get_user_stats(user_id)
     global_limit_reached, global_usage = check_global_audio_limit()
     
-    message = f"📊 *Usage Statistics for {username}*\n\n"
-    message += f"🎤 Your total audio processed: {user_stats['total_audio_min']:.2f} minutes\n"
+    parts = [
+        f"📊 *Usage Statistics for {username}*\n\n",
+        f"🎤 Your total audio processed: {user_stats['total_audio_min']:.2f} minutes\n",
+    ]
     
     if user_stats['last_updated']:
-        message += f"🕒 Your last activity: {user_stats['last_updated']}\n\n"
+        parts.append(f"🕒 Your last activity: {user_stats['last_updated']}\n\n")
     
-    message += f"🌐 Global usage: {global_usage:.2f}/{MAX_AUDIO_MINUTES} minutes"
+    parts.append(f"🌐 Global usage: {global_usage:.2f}/{MAX_AUDIO_MINUTES} minutes")
     
     if global_limit_reached:
-        message += "\n⚠️ Global limit reached. No more transcriptions available."
+        parts.append("\n⚠️ Global limit reached. No more transcriptions available.")
     
-    await update.message.reply_text(message, parse_mode='Markdown')
+    await update.message.reply_text("".join(parts), parse_mode='Markdown')
 
 async def global_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send global audio processing statistics."""
-    stats = get_global_stats()
+    stats = await get_global_stats()
     
-    message = f"🌐 *Global Usage Statistics*\n\n"
-    message += f"🎤 Total audio processed: {stats['total_audio_min']:.2f} minutes\n"
-    message += f"⏳ Remaining quota: {max(0, MAX_AUDIO_MINUTES - stats['total_audio_min']):.2f} minutes\n"
+    parts = [
+        "🌐 *Global Usage Statistics*\n\n",
+        f"🎤 Total audio processed: {stats['total_audio_min']:.2f} minutes\n",
+        f"⏳ Remaining quota: {max(0, MAX_AUDIO_MINUTES - stats['total_audio_min']):.2f} minutes\n",
+    ]
     
     if stats['last_updated']:
-        message += f"🕒 Last activity: {stats['last_updated']}\n\n"
+        parts.append(f"🕒 Last activity: {stats['last_updated']}\n\n")
     
-    message += f"Maximum allowed audio processing is {MAX_AUDIO_MINUTES} minutes in total.\n\n"
+    parts.append(f"Maximum allowed audio processing is {MAX_AUDIO_MINUTES} minutes in total.\n\n")
     
     if stats['top_users']:
-        message += "*Top users:*\n"
-        for i, (username, minutes) in enumerate(stats['top_users'], 1):
-            message += f"{i}. {username or 'Unknown'}: {minutes:.2f} minutes\n"
+        parts.append("*Top users:*\n")
+        parts.append("".join(
+            f"{i}. {username or 'Unknown'}: {minutes:.2f} minutes\n"
+            for i, (username, minutes) in enumerate(stats['top_users'], 1)
+        ))
     
-    await update.message.reply_text(message, parse_mode='Markdown')
+    await update.message.reply_text("".join(parts), parse_mode='Markdown')
 
-def transcribe_audio(file_path):
-    """Transcribe the given audio file using Google Speech-to-Text API."""
-    temp_wav = None
+# ffmpeg command decoding stdin to raw PCM on stdout; short clips don't benefit from extra threads
+FFMPEG_ARGS = (
+    'ffmpeg', '-loglevel', 'error',
+    '-threads', '1',
+    '-i', 'pipe:0',
+    '-ac', '1',                 # Convert to mono
+    '-ar', '16000',             # Convert to 16kHz
+    '-f', 's16le',
+    '-acodec', 'pcm_s16le',     # Convert to 16-bit (2 bytes per sample)
+    '-',
+)
+
+# Start an ffmpeg process that waits for audio on stdin
+async def _spawn_ffmpeg():
+    """Spawn a single-use ffmpeg decoder process."""
+    return await asyncio.create_subprocess_exec(
+        *FFMPEG_ARGS,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+
+# Keep FFMPEG_POOL_SIZE idle processes ready
+async def _fill_ffmpeg_pool():
+    """Spawn ffmpeg processes until the warm pool is full."""
     try:
-        # Convert the audio file to the correct format (WAV, mono, 16kHz, 16-bit)
-        temp_wav = tempfile.NamedTemporaryFile(suffix='.wav', delete=False).name
-        logger.info(f"Converting audio file to proper format: {file_path} -> {temp_wav}")
+        while _ffmpeg_pool.qsize() < FFMPEG_POOL_SIZE:
+            _ffmpeg_pool.put_nowait(await _spawn_ffmpeg())
+    except Exception as e:
+        logger.error("Error spawning ffmpeg: %s", e)
+
+# Hand out a warm ffmpeg process
+async def _acquire_ffmpeg():
+    """Take a pre-spawned ffmpeg process from the pool and start refilling it in the background.
+    
+    The pool starts empty and is first filled by the first message that needs conversion.
+    """
+    global _ffmpeg_refill_task
+    proc = None
+    while not _ffmpeg_pool.empty():
+        candidate = _ffmpeg_pool.get_nowait()
+        if candidate.returncode is None:
+            proc = candidate
+            break
+    
+    # A single refill task at a time, so concurrent acquires can't overfill the pool
+    if _ffmpeg_refill_task is None or _ffmpeg_refill_task.done():
+        _ffmpeg_refill_task = asyncio.create_task(_fill_ffmpeg_pool())
+        _background_tasks.add(_ffmpeg_refill_task)
+        _ffmpeg_refill_task.add_done_callback(_background_tasks.discard)
+    
+    return proc or await _spawn_ffmpeg()
+
+# Stop idle ffmpeg processes
+async def _close_ffmpeg_pool():
+    """Kill the ffmpeg processes still waiting in the pool."""
+    while not _ffmpeg_pool.empty():
+        proc = _ffmpeg_pool.get_nowait()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+# Read the identification header of an Ogg Opus stream
+def _opus_head(audio_data):
+    """Return the OpusHead packet at the start of an Ogg Opus stream, or None for other formats."""
+    if len(audio_data) < 27 or audio_data[:4] != b'OggS':
+        return None
+    # The first Ogg page carries only the OpusHead packet, right after the segment table
+    start = 27 + audio_data[26]
+    head = bytes(audio_data[start:start + 19])
+    if len(head) < 19 or head[:8] != b'OpusHead':
+        return None
+    return head
+
+# Measure an Ogg Opus stream without decoding it
+def _ogg_opus_duration(audio_data, pre_skip):
+    """Return the length of an Ogg Opus stream in seconds from its last granule position, or None."""
+    # The last page header is within the final 64 KiB; its granule position counts 48kHz samples
+    last_page = audio_data.rfind(b'OggS', max(0, len(audio_data) - 65536))
+    if last_page < 0 or last_page + 14 > len(audio_data):
+        return None
+    granule = int.from_bytes(audio_data[last_page + 6:last_page + 14], 'little', signed=True)
+    if granule <= pre_skip:
+        return None
+    return (granule - pre_skip) / 48000
+
+# Yield audio bytes in streaming-request sized pieces
+async def _iter_chunks(audio_data):
+    """Split in-memory audio into STREAM_CHUNK_BYTES chunks."""
+    view = memoryview(audio_data)
+    for i in range(0, len(view), STREAM_CHUNK_BYTES):
+        yield bytes(view[i:i + STREAM_CHUNK_BYTES])
+
+# Run one streaming recognition over the given audio chunks
+async def _recognize(config_request, chunks):
+    """Stream the config request followed by the audio chunks and return the joined transcript."""
+    async def request_stream():
+        yield config_request
+        async for chunk in chunks:
+            yield speech.StreamingRecognizeRequest(audio_content=chunk)
+    
+    # Collect the final results as they arrive
+    parts = []
+    responses = await speech_client.streaming_recognize(requests=request_stream())
+    async for response in responses:
+        for result in response.results:
+            if result.alternatives:
+                parts.append(result.alternatives[0].transcript)
+    
+    # Join all transcribed parts
+    return "".join(parts)
+
+async def transcribe_audio(audio_data, duration_sec):
+    """Transcribe the given audio bytes using Google Speech-to-Text streaming recognition.
+    
+    Mono Ogg Opus (the format of Telegram voice messages) is sent as-is and measured from its
+    Ogg page headers, falling back to duration_sec; anything else is decoded to PCM by ffmpeg
+    and measured from the output.
+    """
+    proc = None
+    feeder = None
+    try:
+        head = _opus_head(audio_data)
+        if head and head[9] == 1:
+            logger.debug("Sending %d bytes of Ogg Opus audio without conversion", len(audio_data))
+            input_rate = int.from_bytes(head[12:16], 'little')
+            config_request = _OGG_OPUS_CONFIG_REQUESTS.get(input_rate, _OGG_OPUS_CONFIG_REQUESTS[48000])
+            transcript = await _recognize(config_request, _iter_chunks(audio_data))
+            pre_skip = int.from_bytes(head[10:12], 'little')
+            return _ogg_opus_duration(audio_data, pre_skip) or duration_sec, transcript
         
-        # Process audio in one go with chained operations
-        audio = (AudioSegment.from_file(file_path)
-                .set_channels(1)         # Convert to mono
-                .set_frame_rate(16000)   # Convert to 16kHz
-                .set_sample_width(2))    # Convert to 16-bit (2 bytes per sample)
+        # Feed the audio through ffmpeg's stdin and read raw PCM (mono, 16kHz, 16-bit) from stdout
+        logger.debug("Converting %d bytes of audio to proper format", len(audio_data))
+        proc = await _acquire_ffmpeg()
         
-        audio.export(temp_wav, format="wav")
-        audio_length_sec = len(audio) / 1000  # Length in seconds
+        async def feed_stdin():
+            try:
+                proc.stdin.write(audio_data)
+                await proc.stdin.drain()
+            finally:
+                proc.stdin.close()
         
-        # Configure and perform speech recognition
-        with open(temp_wav, "rb") as audio_file:
-            response = speech_client.recognize(
-                config=speech.RecognitionConfig(
-                    encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                    sample_rate_hertz=16000,
-                    language_code="sr-RS",  # Serbian language code
-                    model="default",
-                    enable_automatic_punctuation=True,
-                ),
-                audio=speech.RecognitionAudio(content=audio_file.read())
-            )
+        pcm_bytes = 0
         
-        # Join all transcribed parts
-        transcript = "".join(result.alternatives[0].transcript for result in response.results)
+        async def pcm_chunks():
+            nonlocal pcm_bytes
+            # Send PCM to the API as ffmpeg produces it
+            while chunk := await proc.stdout.read(STREAM_CHUNK_BYTES):
+                pcm_bytes += len(chunk)
+                yield chunk
+        
+        feeder = asyncio.create_task(feed_stdin())
+        transcript = await _recognize(_STT_CONFIG_REQUEST, pcm_chunks())
+        
+        if await proc.wait() != 0:
+            stderr = await proc.stderr.read()
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+        await feeder
+        
+        audio_length_sec = pcm_bytes / (2 * 16000)  # Length in seconds
         
         return audio_length_sec, transcript
     
     except Exception as e:
-        logger.error(f"Error during transcription: {e}")
+        logger.error("Error during transcription: %s", e)
         return 0, f"Transcription error: {str(e)}"
     
     finally:
-        # Clean up temporary files
-        try:
-            if temp_wav and os.path.exists(temp_wav):
-                os.unlink(temp_wav)
-            if file_path and os.path.exists(file_path):
-                os.unlink(file_path)
-        except Exception as e:
-            logger.error(f"Error cleaning up temporary files: {e}")
+        # Don't leave ffmpeg or the stdin writer behind if streaming failed midway
+        if feeder and not feeder.done():
+            feeder.cancel()
+        if proc and proc.returncode is None:
+            proc.kill()
+            await proc.wait()
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle voice messages and transcribe them."""
@@ -363,25 +706,30 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
         return
     
+    # Reject clips the streaming API would cut off, before downloading or decoding anything
+    voice = update.message.voice
+    if voice.duration > MAX_STREAM_AUDIO_SEC:
+        await update.message.reply_text(
+            f"⚠️ Sorry, voice messages longer than {MAX_STREAM_AUDIO_SEC // 60} minutes "
+            f"can't be transcribed."
+        )
+        return
+    
     # Reply to let the user know we're processing the voice message
     message = await update.message.reply_text("Processing your voice message...")
     
     try:
         # Get the voice message file
-        voice_file = await context.bot.get_file(update.message.voice.file_id)
-        
-        # Download the file to a temporary location
-        temp_file = tempfile.NamedTemporaryFile(delete=False).name
-        await voice_file.download_to_drive(temp_file)
+        voice_file = await context.bot.get_file(voice.file_id)
         
-        # Transcribe the voice message and get audio length in an executor
-        audio_length_sec, transcript = await asyncio.to_thread(transcribe_audio, temp_file)
+        # Download the file into memory; the bytearray is used as-is, without copying it to bytes
+        audio_data = await voice_file.download_as_bytearray()
         
-        # Track the audio processing
-        track_audio_processing(user_id, username, audio_length_sec)
+        # Transcribe the voice message and get audio length
+        audio_length_sec, transcript = await transcribe_audio(audio_data, voice.duration)
         
-        # Check if this transcription put us over the limit
-        limit_reached, current_usage = check_global_audio_limit()
+        # Track the audio processing and check if this transcription put us over the limit
+        limit_reached, current_usage = record_and_check(user_id, username, audio_length_sec)
         limit_message = ""
         if limit_reached:
             limit_message = f"\n\n⚠️ Global limit reached: {current_usage:.2f}/{MAX_AUDIO_MINUTES} minutes used."
@@ -392,14 +740,97 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         else:
             await message.edit_text(f"Sorry, I couldn't transcribe that voice message.{limit_message}")
     except Exception as e:
-        logger.error(f"Error handling voice message: {e}")
+        logger.error("Error handling voice message: %s", e)
         await message.edit_text(f"Error: {str(e)}")
 
+async def post_init(app: Application) -> None:
+    """Prepare the database, speech client and background tasks once the event loop is running."""
+    global _flusher_task
+    await init_db()
+    await load_total_audio_sec()
+    init_speech_client()
+    _flusher_task = asyncio.create_task(flusher())
+    
+    task = asyncio.create_task(checkpointer())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def post_shutdown(app: Application) -> None:
+    """Flush queued stats, stop background tasks and idle ffmpeg processes, and close pooled database connections."""
+    await flusher_drain()
+    for task in list(_background_tasks):
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    await _close_ffmpeg_pool()
+    await pool.close()
+    logger.info("Shutdown cleanup completed")
+
+def init() -> None:
+    """Load configuration from the environment, set up logging and the data directory."""
+    global TELEGRAM_TOKEN, DB_PATH
+    
+    # Load environment variables from .env file first
+    load_dotenv()
+    
+    # Configure logging with more detailed format
+    # Get log level from environment variable, default to INFO if not specified
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    numeric_level = getattr(logging, LOG_LEVEL.upper(), logging.INFO)
+    
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=numeric_level
+    )
+    
+    # httpx logs every Bot API request (including each getUpdates poll) at INFO
+    if numeric_level > logging.DEBUG:
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+    
+    logger.info("Logging level set to: %s", LOG_LEVEL)
+    
+    # Get environment variables
+    TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+    logger.debug("Loaded TELEGRAM_TOKEN: %s", log_sensitive_info(TELEGRAM_TOKEN))
+    DB_PATH = os.getenv('DB_PATH', DB_PATH)
+    
+    # Create data directory if it doesn't exist
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    
+    # Log key environment variables and config
+    logger.info("Configuration summary:")
+    # Log the existence of .env file
+    env_path = os.path.join(os.getcwd(), '.env')
+    env_exists = os.path.exists(env_path)
+    logger.info(".env file: %s at %s", 'Present' if env_exists else 'Not found', env_path)
+    
+    # Log critical environment variables with masking
+    critical_vars = {
+        "TELEGRAM_TOKEN": TELEGRAM_TOKEN,
+        "GOOGLE_APPLICATION_CREDENTIALS": os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+    }
+    
+    for key, value in critical_vars.items():
+        if value:
+            logger.info("  %s: %s", key, log_sensitive_info(value) if 'TOKEN' in key or 'KEY' in key or 'SECRET' in key else value)
+        else:
+            logger.error("  %s: Missing", key)
+    
+    if not TELEGRAM_TOKEN:
+        logger.error("TELEGRAM_TOKEN not found in environment variables.")
+        raise ValueError("TELEGRAM_TOKEN not found in environment variables.")
+
 def main() -> None:
     """Start the bot."""
+    init()
+    
     # Create the Application and pass it your bot's token
     logger.info("Starting bot using non-asyncio entry point")
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    app = (Application.builder()
+           .token(TELEGRAM_TOKEN)
+           .concurrent_updates(MAX_CONCURRENT_UPDATES)
+           .post_init(post_init)
+           .post_shutdown(post_shutdown)
+           .build())
     
     # Add command handlers
     app.add_handler(CommandHandler("start", start))